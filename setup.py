@@ -17,6 +17,7 @@ setuptools.setup(
     url="https://github.com/spslater/targpg",
     license="MIT License",
     packages=setuptools.find_packages(),
+    extras_require={"fsspec": ["fsspec"]},
     classifiers=[
         "Development Status :: 4 - Beta",
         "Programming Language :: Python :: 3",
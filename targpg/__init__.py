@@ -1,4 +1,7 @@
 """Targpg - secure a compressed tarfile with gpg password"""
 from .targpg import *
+from .cache import *
+from .delta import *
+from .members import *
 from .meta import *
 from .parser import *
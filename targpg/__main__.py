@@ -23,6 +23,8 @@ def main():
             filename=args.archive,
             passfile=args.passfile,
             autocreate=args.autocreate,
+            cache=args.cache,
+            history=args.history,
         )
     except PermissionError:
         tglog.info("\nPasswords do not match, bye")
@@ -46,11 +48,13 @@ def main():
             tar.add(
                 *args.add,
                 directory=args.directory,
+                exclude=args.exclude,
             )
         if args.update:
             tar.update(
                 *args.update,
                 directory=args.directory,
+                exclude=args.exclude,
             )
         if args.remove:
             tar.remove(
@@ -59,10 +63,14 @@ def main():
             )
 
         if args.extr is not None:
-            tar.extract(*args.extr, outdir=args.output)
+            tar.extract(*args.extr, outdir=args.output, version=args.at)
 
         if args.list:
-            tar.list()
+            tar.list(version=args.at)
+
+        if args.grep:
+            for name, offset in tar.search(args.grep):
+                print(f"{name}:{offset}")
     except (KeyboardInterrupt, FileNotFoundError) as e:
         tglog.error("error; %s", e)
         tglog.info("\nExiting program, cya later")
@@ -0,0 +1,156 @@
+"""Encrypted on disk cache of archive member metadata"""
+__all__ = ["MetaCache"]
+
+import json
+import os
+from hashlib import pbkdf2_hmac, sha256
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+from gnupg import GPG
+
+from .members import MemberTable
+
+Pathname = Union[str, Path]
+
+KEY_ROUNDS = 100_000
+
+
+class MetaCache:
+    """Member index of an archive kept in a gpg encrypted file
+
+    The cache is keyed by the archive path and only trusted when the
+    archive's size, mtime and ciphertext digest still match what was
+    stored with it. The passphrase for the cache file is derived from
+    the archive password so it can't be read without it.
+
+    :param archive: archive file the index belongs to
+    :type archive: Pathname
+    :param cachedir: directory cache files are kept in
+    :type cachedir: Pathname
+    :param gpg: gpg instance used to encrypt and decrypt the cache
+    :type gpg: GPG
+    """
+
+    def __init__(self, archive: Pathname, cachedir: Pathname, gpg: GPG):
+        self.archive = Path(archive).resolve()
+        self.ident = sha256(str(self.archive).encode("utf-8")).hexdigest()
+        self.cachedir = Path(cachedir)
+        self.filename = self.cachedir.joinpath(f"{self.ident}.gpg")
+        self.gpg = gpg
+
+    @staticmethod
+    def fingerprint(archive: Pathname, data: bytes) -> dict:
+        """Identify the exact version of an archive
+
+        :param archive: archive file on disk
+        :type archive: Pathname
+        :param data: encrypted contents of the archive
+        :type data: bytes
+        :return: path, size, mtime and digest of the archive
+        :rtype: dict
+        """
+        stat = os.stat(archive)
+        return {
+            "path": str(Path(archive).resolve()),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "digest": sha256(data).hexdigest(),
+        }
+
+    def _key(self, password: str) -> str:
+        return pbkdf2_hmac(
+            "sha256",
+            password.encode("utf-8"),
+            self.ident.encode("utf-8"),
+            KEY_ROUNDS,
+        ).hex()
+
+    def load(
+        self,
+        fingerprint: dict,
+        password: str,
+    ) -> Optional[Tuple[MemberTable, List[str]]]:
+        """Get the member index if it was stored for this archive version
+
+        :param fingerprint: fingerprint of the archive on disk
+        :type fingerprint: dict
+        :param password: archive password
+        :type password: str
+        :return: members and the sha256 of their contents,
+            None if there is no usable cache
+        :rtype: Optional[Tuple[MemberTable, List[str]]]
+        """
+        try:
+            with open(self.filename, "rb") as fp:
+                data = self.gpg.decrypt_file(fp, passphrase=self._key(password))
+        except FileNotFoundError:
+            return None
+        if not data.ok:
+            return None
+
+        cached = json.loads(data.data.decode("utf-8"))
+        if cached["fingerprint"] != fingerprint:
+            return None
+
+        try:
+            members = MemberTable.fromcolumns(cached["members"])
+        except KeyError:
+            return None
+        return members, cached["digests"]
+
+    def store(
+        self,
+        fingerprint: dict,
+        members: MemberTable,
+        digests: List[str],
+        password: str,
+    ) -> "MetaCache":
+        """Save the member index of an archive version
+
+        :param fingerprint: fingerprint of the archive on disk
+        :type fingerprint: dict
+        :param members: members of the archive
+        :type members: MemberTable
+        :param digests: sha256 of the contents of each member
+        :type digests: List[str]
+        :param password: archive password
+        :type password: str
+        :raises RuntimeError: unable to encrypt the cache
+        :return: self to allow chaining
+        :rtype: MetaCache
+        """
+        payload = json.dumps(
+            {
+                "fingerprint": fingerprint,
+                "members": members.columns(),
+                "digests": digests,
+            }
+        )
+
+        data = self.gpg.encrypt(
+            payload.encode("utf-8"),
+            recipients=None,
+            symmetric=True,
+            passphrase=self._key(password),
+        )
+        if not data.ok:
+            raise RuntimeError(f"Unable to encrypt the cache; {data.status}")
+
+        self.cachedir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        temp = self.filename.with_suffix(".tmp")
+        temp.write_bytes(data.data)
+        os.replace(temp, self.filename)
+        return self
+
+    def clear(self) -> "MetaCache":
+        """Remove the cache file for the archive
+
+        :return: self to allow chaining
+        :rtype: MetaCache
+        """
+        try:
+            self.filename.unlink()
+        except FileNotFoundError:
+            pass
+        return self
@@ -0,0 +1,122 @@
+"""Binary deltas between versions of a file"""
+__all__ = ["make_delta", "apply_delta", "delta_size"]
+
+import struct
+import zlib
+
+BLOCK = 32
+STRIDE = BLOCK - 1
+MAGIC = b"TGD1"
+HEADER = struct.Struct(">4sQ")
+COPY = struct.Struct(">cQQ")
+INSERT = struct.Struct(">cQ")
+
+
+def _extend(base: bytes, target: bytes, bpos: int, tpos: int) -> int:
+    """Length of the matching run of bytes starting at both positions"""
+    length = 0
+    while (
+        tpos + length + BLOCK <= len(target)
+        and bpos + length + BLOCK <= len(base)
+        and target[tpos + length : tpos + length + BLOCK]
+        == base[bpos + length : bpos + length + BLOCK]
+    ):
+        length += BLOCK
+    while (
+        tpos + length < len(target)
+        and bpos + length < len(base)
+        and target[tpos + length] == base[bpos + length]
+    ):
+        length += 1
+    return length
+
+
+def make_delta(base: bytes, target: bytes) -> bytes:
+    """Encode `target` as copies out of `base` and literal inserts
+
+    Blocks of `base` are indexed by content and `target` is scanned for
+    them, each hit is grown backwards and forwards as far as the bytes keep
+    matching. On a miss the scan skips ahead by one byte less than a block,
+    so every alignment against the base blocks is still tried once a shared
+    run is about `BLOCK * STRIDE` bytes long. The ops are zlib compressed so
+    unmatched literals don't cost their full size.
+
+    :param base: version the delta is applied to
+    :type base: bytes
+    :param target: version the delta rebuilds
+    :type target: bytes
+    :return: compressed delta
+    :rtype: bytes
+    """
+    index = {}
+    for offset in range(0, len(base) - BLOCK + 1, BLOCK):
+        index.setdefault(base[offset : offset + BLOCK], offset)
+
+    ops = [HEADER.pack(MAGIC, len(target))]
+    literal = 0
+    pos = 0
+    while pos + BLOCK <= len(target):
+        offset = index.get(target[pos : pos + BLOCK])
+        if offset is None:
+            pos += STRIDE
+            continue
+        while pos > literal and offset > 0 and target[pos - 1] == base[offset - 1]:
+            pos -= 1
+            offset -= 1
+        if pos > literal:
+            ops.append(INSERT.pack(b"I", pos - literal) + target[literal:pos])
+        length = _extend(base, target, offset, pos)
+        ops.append(COPY.pack(b"C", offset, length))
+        pos += length
+        literal = pos
+    if literal < len(target):
+        ops.append(INSERT.pack(b"I", len(target) - literal) + target[literal:])
+    return zlib.compress(b"".join(ops))
+
+
+def delta_size(delta: bytes) -> int:
+    """Size of the version a delta rebuilds without applying it
+
+    :param delta: compressed delta
+    :type delta: bytes
+    :return: length of the rebuilt data
+    :rtype: int
+    """
+    header = zlib.decompressobj().decompress(delta, HEADER.size)
+    _, size = HEADER.unpack(header)
+    return size
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    """Rebuild a version from the base it was diffed against
+
+    :param base: version the delta was made against
+    :type base: bytes
+    :param delta: compressed delta
+    :type delta: bytes
+    :raises ValueError: delta is corrupt or doesn't belong to `base`
+    :return: the rebuilt version
+    :rtype: bytes
+    """
+    ops = zlib.decompress(delta)
+    magic, size = HEADER.unpack_from(ops)
+    if magic != MAGIC:
+        raise ValueError("Not a targpg delta")
+
+    out = []
+    pos = HEADER.size
+    while pos < len(ops):
+        if ops[pos : pos + 1] == b"C":
+            _, offset, length = COPY.unpack_from(ops, pos)
+            out.append(base[offset : offset + length])
+            pos += COPY.size
+        else:
+            _, length = INSERT.unpack_from(ops, pos)
+            pos += INSERT.size
+            out.append(ops[pos : pos + length])
+            pos += length
+
+    data = b"".join(out)
+    if len(data) != size:
+        raise ValueError("Delta does not match its base")
+    return data
@@ -0,0 +1,206 @@
+"""Read-only fsspec filesystem over the files in a Targpg archive
+
+Needs the optional `fsspec` dependency, `pip install targpg[fsspec]`
+"""
+__all__ = ["TargpgFileSystem"]
+
+import posixpath
+from collections import OrderedDict
+from threading import Lock
+from typing import List, Optional, Union
+
+from fsspec import AbstractFileSystem
+from fsspec.spec import AbstractBufferedFile
+
+from .targpg import Pathname, Targpg
+
+CACHE_SIZE = 64 * 1024 * 1024
+BLOCK_SIZE = 1024 * 1024
+
+
+class TargpgFile(AbstractBufferedFile):
+    """File in the archive read through the filesystem's block cache"""
+
+    def _fetch_range(self, start: int, end: int) -> bytes:
+        return self.fs.cat_file(self.path, start, end)
+
+
+# pylint: disable=abstract-method,protected-access
+class TargpgFileSystem(AbstractFileSystem):
+    """Read the files in an archive through fsspec without extracting them
+
+    The listing follows the archive's member table and is rebuilt whenever
+    the archive changes. Reads only copy the blocks of a file they need out
+    of the in memory tar, blocks are kept in a least recently used cache so
+    later reads of the same range are served from the cached bytes.
+
+    :param archive: open archive or the filename of one to open
+    :type archive: Union[Targpg, Pathname]
+    :param cachesize: max bytes of file contents to keep cached,
+        defaults to 64 MiB
+    :type cachesize: int
+    :param blocksize: bytes of a file read and cached together,
+        defaults to 1 MiB
+    :type blocksize: int
+    :param **kwargs: passed on to `Targpg` when opening by filename
+    """
+
+    protocol = "targpg"
+    root_marker = ""
+    cachable = False
+
+    def __init__(
+        self,
+        archive: Union[Targpg, Pathname],
+        cachesize: int = CACHE_SIZE,
+        blocksize: int = BLOCK_SIZE,
+        **kwargs,
+    ):
+        super().__init__()
+        if not isinstance(archive, Targpg):
+            archive = Targpg(archive, **kwargs)
+        self.archive = archive
+        self.cachesize = cachesize
+        self.blocksize = blocksize
+        self.blocks = OrderedDict()
+        self.cached = 0
+        self.lock = Lock()
+        self.members = None
+        self.count = 0
+        self.children = {}
+        self.files = {}
+
+    def _refresh(self):
+        """Rebuild the listing and drop cached blocks if the archive changed"""
+        self.archive._require_tar()
+        members = self.archive.members
+        if members is self.members and len(members) == self.count:
+            return
+        self.members = members
+        self.count = len(members)
+        self.blocks.clear()
+        self.cached = 0
+        self.children = {}
+        self.files = {}
+        self._mkdir(self.root_marker)
+        self._index()
+
+    def _mkdir(self, path: str, row: Optional[int] = None):
+        if path in self.children:
+            if row is not None:
+                self.files[path] = row
+            return
+        self.children[path] = []
+        self.files[path] = row
+        if path != self.root_marker:
+            parent = posixpath.dirname(path)
+            self._mkdir(parent)
+            self.children[parent].append(path)
+
+    def _index(self):
+        members = self.members
+        for row, name in enumerate(members.names):
+            if self.archive._hidden(name):
+                continue
+            path = self._strip_protocol(name)
+            if members.isdir(row):
+                self._mkdir(path, row)
+            elif members.isreg(row):
+                parent = posixpath.dirname(path)
+                self._mkdir(parent)
+                self.children[parent].append(path)
+                self.files[path] = row
+
+    def _entry(self, path: str) -> dict:
+        if path not in self.files:
+            raise FileNotFoundError(path)
+        row = self.files[path]
+        isdir = path in self.children
+        if row is None:
+            return {"name": path, "size": 0, "type": "directory"}
+        members = self.members
+        return {
+            "name": path,
+            "size": 0 if isdir else members.sizes[row],
+            "type": "directory" if isdir else "file",
+            "mode": members.modes[row],
+            "mtime": members.mtimes[row],
+        }
+
+    def _block(self, view: memoryview, path: str, row: int, block: int) -> bytes:
+        """A block of a file, from the cache when it's been read before"""
+        key = (path, block)
+        if key in self.blocks:
+            self.blocks.move_to_end(key)
+            return self.blocks[key]
+
+        start = block * self.blocksize
+        end = min(start + self.blocksize, self.members.sizes[row])
+        offset = self.members.datas[row]
+        data = bytes(view[offset + start : offset + end])
+        if len(data) <= self.cachesize:
+            self.blocks[key] = data
+            self.cached += len(data)
+            while self.cached > self.cachesize:
+                _, dropped = self.blocks.popitem(last=False)
+                self.cached -= len(dropped)
+        return data
+
+    def ls(self, path: str, detail: bool = True, **kwargs) -> List:
+        path = self._strip_protocol(path)
+        with self.lock:
+            self._refresh()
+            found = self.children.get(path, [path])
+            if detail:
+                return [self._entry(child) for child in found]
+            if path not in self.files:
+                raise FileNotFoundError(path)
+            return found
+
+    def info(self, path: str, **kwargs) -> dict:
+        with self.lock:
+            self._refresh()
+            return self._entry(self._strip_protocol(path))
+
+    def cat_file(self, path: str, start=None, end=None, **kwargs) -> bytes:
+        path = self._strip_protocol(path)
+        with self.lock:
+            self._refresh()
+            if path not in self.files:
+                raise FileNotFoundError(path)
+            if path in self.children:
+                raise IsADirectoryError(path)
+            row = self.files[path]
+            start, end, _ = slice(start, end).indices(self.members.sizes[row])
+            if start >= end:
+                return b""
+
+            first, last = start // self.blocksize, (end - 1) // self.blocksize
+            with self.archive.raw.getbuffer() as view:
+                data = b"".join(
+                    self._block(view, path, row, block)
+                    for block in range(first, last + 1)
+                )
+            skip = start - first * self.blocksize
+            return data[skip : skip + end - start]
+
+    # pylint: disable=too-many-arguments
+    def _open(
+        self,
+        path: str,
+        mode: str = "rb",
+        block_size=None,
+        autocommit=True,
+        cache_options=None,
+        **kwargs,
+    ) -> TargpgFile:
+        if mode != "rb":
+            raise NotImplementedError("Archive filesystem is read-only")
+        return TargpgFile(
+            self,
+            self._strip_protocol(path),
+            mode,
+            block_size=block_size or self.blocksize,
+            cache_type="none",
+            size=self.info(path)["size"],
+        )
@@ -0,0 +1,253 @@
+"""Compact table of the members in an uncompressed tar"""
+__all__ = ["MemberTable"]
+
+import sys
+import tarfile
+from array import array
+from io import BytesIO
+from typing import Dict, List, Optional
+
+COLUMNS = (
+    "types",
+    "modes",
+    "uids",
+    "gids",
+    "sizes",
+    "mtimes",
+    "devmajors",
+    "devminors",
+)
+NAMES = ("names", "unames", "gnames", "linknames")
+REGULAR = {regtype[0] for regtype in tarfile.REGULAR_TYPES}
+
+
+def _padded(size: int) -> int:
+    blocks, remainder = divmod(size, tarfile.BLOCKSIZE)
+    return (blocks + bool(remainder)) * tarfile.BLOCKSIZE
+
+
+class MemberTable:
+    """Metadata of tar members kept in parallel columns
+
+    Every member is a row. Numbers live in typed arrays and strings are
+    interned, so user, group and link names repeated across many members
+    are only stored once. Member names are kept as whole paths, parent
+    directories aren't shared between them. Besides the header
+    fields each row holds where its headers start, where its data starts
+    and where the member ends in the tar it was read from. Full `TarInfo`
+    objects are only made when a member is actually written or extracted.
+    """
+
+    __slots__ = (
+        "names",
+        "types",
+        "modes",
+        "uids",
+        "gids",
+        "unames",
+        "gnames",
+        "sizes",
+        "mtimes",
+        "devmajors",
+        "devminors",
+        "linknames",
+        "offsets",
+        "datas",
+        "ends",
+        "rows",
+        "end",
+    )
+
+    def __init__(self):
+        self.names = []
+        self.types = bytearray()
+        self.modes = array("L")
+        self.uids = array("Q")
+        self.gids = array("Q")
+        self.unames = []
+        self.gnames = []
+        self.sizes = array("Q")
+        self.mtimes = array("d")
+        self.devmajors = array("L")
+        self.devminors = array("L")
+        self.linknames = []
+        self.offsets = array("Q")
+        self.datas = array("Q")
+        self.ends = array("Q")
+        self.rows = {}
+        self.end = 0
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.rows
+
+    def get(self, name: str) -> Optional[int]:
+        """Row of the last member with the name, None if there isn't one"""
+        return self.rows.get(name)
+
+    def isreg(self, row: int) -> bool:
+        """If the member is a regular file"""
+        return self.types[row] in REGULAR
+
+    def isdir(self, row: int) -> bool:
+        """If the member is a directory"""
+        return self.types[row] == tarfile.DIRTYPE[0]
+
+    def isdev(self, row: int) -> bool:
+        """If the member is a character or block device"""
+        return self.types[row] in (tarfile.CHRTYPE[0], tarfile.BLKTYPE[0])
+
+    def append(
+        self,
+        tarinfo: tarfile.TarInfo,
+        offset: int,
+        data: int,
+        end: int,
+    ) -> int:
+        """Add a member to the table
+
+        :param tarinfo: header fields of the member
+        :type tarinfo: tarfile.TarInfo
+        :param offset: position the member's first header starts at
+        :type offset: int
+        :param data: position the member's data starts at
+        :type data: int
+        :param end: position after the member's padded data
+        :type end: int
+        :return: row of the member
+        :rtype: int
+        """
+        row = len(self.names)
+        name = tarinfo.name
+        if tarinfo.isdir():
+            name = name.rstrip("/")
+        self.names.append(sys.intern(name))
+        self.types.append(tarinfo.type[0])
+        self.modes.append(tarinfo.mode & 0o7777)
+        self.uids.append(tarinfo.uid)
+        self.gids.append(tarinfo.gid)
+        self.unames.append(sys.intern(tarinfo.uname))
+        self.gnames.append(sys.intern(tarinfo.gname))
+        self.sizes.append(tarinfo.size)
+        self.mtimes.append(tarinfo.mtime)
+        self.devmajors.append(tarinfo.devmajor)
+        self.devminors.append(tarinfo.devminor)
+        self.linknames.append(sys.intern(tarinfo.linkname))
+        self.offsets.append(offset)
+        self.datas.append(data)
+        self.ends.append(end)
+        self.rows[self.names[row]] = row
+        return row
+
+    def copyrow(self, other: "MemberTable", row: int, offset: int) -> int:
+        """Add a member of another table that was copied to `offset`
+
+        :param other: table the member is in
+        :type other: MemberTable
+        :param row: row of the member in `other`
+        :type row: int
+        :param offset: position the member's headers were copied to
+        :type offset: int
+        :return: row of the member in this table
+        :rtype: int
+        """
+        new = len(self.names)
+        shift = offset - other.offsets[row]
+        for column in NAMES + COLUMNS:
+            getattr(self, column).append(getattr(other, column)[row])
+        self.offsets.append(offset)
+        self.datas.append(other.datas[row] + shift)
+        self.ends.append(other.ends[row] + shift)
+        self.rows[self.names[new]] = new
+        return new
+
+    def addfile(
+        self,
+        tar: tarfile.TarFile,
+        tarinfo: tarfile.TarInfo,
+        fileobj=None,
+    ) -> int:
+        """Write a member with a tar in write mode and add it to the table
+
+        The `TarInfo` the tar keeps for the member is dropped.
+
+        :param tar: tar writing after the last member in the table
+        :type tar: tarfile.TarFile
+        :param tarinfo: header of the member
+        :type tarinfo: tarfile.TarInfo
+        :param fileobj: contents of the member, defaults to None
+        :return: row of the member
+        :rtype: int
+        """
+        offset = tar.offset
+        tar.addfile(tarinfo, fileobj)
+        tar.members.clear()
+        self.end = tar.offset
+        data = self.end - _padded(tarinfo.size) if tarinfo.isreg() else self.end
+        return self.append(tarinfo, offset, data, self.end)
+
+    def tarinfo(self, tar: tarfile.TarFile, row: int) -> tarfile.TarInfo:
+        """Parse the full header of a member again
+
+        :param tar: tar in read mode over the data the table was built from
+        :type tar: tarfile.TarFile
+        :param row: row of the member
+        :type row: int
+        :return: header of the member
+        :rtype: tarfile.TarInfo
+        """
+        offset = tar.offset
+        tar.fileobj.seek(self.offsets[row])
+        tarinfo = tar.tarinfo.fromtarfile(tar)
+        tar.offset = offset
+        return tarinfo
+
+    def columns(self) -> Dict[str, List]:
+        """Header fields of every member as plain lists"""
+        columns = {column: list(getattr(self, column)) for column in NAMES + COLUMNS}
+        columns["types"] = self.types.decode("latin-1")
+        return columns
+
+    @classmethod
+    def fromcolumns(cls, columns: Dict[str, List]) -> "MemberTable":
+        """Rebuild a table from `columns`, without any positions in a tar"""
+        table = cls()
+        for column in NAMES:
+            getattr(table, column).extend(sys.intern(v) for v in columns[column])
+        table.types.extend(columns["types"].encode("latin-1"))
+        for column in COLUMNS[1:]:
+            getattr(table, column).extend(columns[column])
+        zeros = [0] * len(table.names)
+        for column in ("offsets", "datas", "ends"):
+            getattr(table, column).extend(zeros)
+        table.rows = {name: row for row, name in enumerate(table.names)}
+        return table
+
+    @classmethod
+    def scan(cls, raw: BytesIO) -> "MemberTable":
+        """Read the headers of a tar without keeping a `TarInfo` per member
+
+        :param raw: uncompressed tar data
+        :type raw: BytesIO
+        :return: table of the members, empty if `raw` isn't a tar
+        :rtype: MemberTable
+        """
+        table = cls()
+        raw.seek(0)
+        try:
+            tar = tarfile.TarFile(fileobj=raw, mode="r")
+        except tarfile.ReadError:
+            return table
+        with tar:
+            while True:
+                tarinfo = tar.next()
+                tar.members.clear()
+                if tarinfo is None:
+                    break
+                table.append(tarinfo, tarinfo.offset, tarinfo.offset_data, 0)
+            table.end = tar.offset
+        table.ends = array("Q", table.offsets[1:])
+        table.ends.append(table.end)
+        return table
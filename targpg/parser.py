@@ -73,6 +73,14 @@ def targpg_parser() -> ArgumentParser:
         dest="passfile",
         help="file with archive password stored in it",
     )
+    parser.add_argument(
+        "-C",
+        "--cache",
+        action="store_true",
+        dest="cache",
+        default=False,
+        help="keep an encrypted index of the archive to list it without decrypting",
+    )
     parser.add_argument(
         "-o",
         "--output",
@@ -113,6 +121,15 @@ def targpg_parser() -> ArgumentParser:
         nargs="*",
         help="add files to the archive",
     )
+    parser.add_argument(
+        "-x",
+        "--exclude",
+        action=ComboListAction,
+        dest="exclude",
+        nargs="*",
+        help="glob patterns of paths to skip when adding or updating directories",
+        metavar="PATTERN",
+    )
     parser.add_argument(
         "-u",
         "--update",
@@ -121,6 +138,15 @@ def targpg_parser() -> ArgumentParser:
         nargs="*",
         help="overwrite existing files if any being passed in match",
     )
+    parser.add_argument(
+        "-H",
+        "--history",
+        dest="history",
+        type=int,
+        default=0,
+        help="keep this many previous versions of updated files",
+        metavar="N",
+    )
     parser.add_argument(
         "-r",
         "--remove",
@@ -139,6 +165,22 @@ def targpg_parser() -> ArgumentParser:
         help="extract the files from the archive, if no files given a prompt will ask",
     )
 
+    parser.add_argument(
+        "-t",
+        "--at-version",
+        dest="at",
+        type=int,
+        default=0,
+        help="extract or list files as they were this many updates ago",
+        metavar="N",
+    )
+    parser.add_argument(
+        "-g",
+        "--grep",
+        dest="grep",
+        help="print files and offsets with contents matching a regular expression",
+        metavar="PATTERN",
+    )
     parser.add_argument(
         "-l",
         "--list",
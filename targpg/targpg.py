@@ -3,15 +3,33 @@ __all__ = ["Targpg", "tglog"]
 
 import gzip
 import logging
+import os
+import re
+import shutil
 import sys
 import tarfile
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from fnmatch import fnmatch
 from getpass import getpass
+from hashlib import sha256
 from io import BytesIO
 from pathlib import Path
-from typing import Optional, Union
+from stat import filemode
+from time import localtime, strftime
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
 from gnupg import GPG
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .cache import MetaCache
+from .delta import apply_delta, delta_size, make_delta
+from .members import MemberTable
 from .meta import __author__, __version__
 
 PROG_NAME = Path(__file__).stem
@@ -26,6 +44,20 @@ Pathname = Union[str, Path]
 
 Path.__eq__ = lambda self, b: str(self) == str(b)
 
+INGEST_WORKERS = 4
+INGEST_BUFFER = 64 * 1024 * 1024
+HISTORY_DIR = ".targpg-history"
+VERSIONED = re.compile(rf"{re.escape(HISTORY_DIR)}/(.+);(\d+)", re.DOTALL)
+BINARY_SNIFF = 8192
+
+
+def _cachedir() -> Path:
+    """Default directory for member caches, `$XDG_CACHE_HOME/targpg`"""
+    return Path(
+        os.environ.get("XDG_CACHE_HOME") or Path.home().joinpath(".cache"),
+        PROG_NAME,
+    )
+
 
 class Targpg:
     """Mangae a password protected tar archvie
@@ -37,15 +69,39 @@ class Targpg:
     :param autocreate: if archive does not exist create it without confirmation,
         defaults to False
     :type autocreate: bool
+    :param workers: threads used to read files being added, defaults to 4
+    :type workers: int
+    :param maxbuffer: max bytes of file data read ahead while adding,
+        defaults to 64 MiB
+    :type maxbuffer: int
+    :param cache: keep an encrypted index of the members on disk so listing
+        doesn't need to decrypt the archive, defaults to False
+    :type cache: bool
+    :param cachedir: directory to keep the index in,
+        defaults to `$XDG_CACHE_HOME/targpg`
+    :type cachedir: Optional[Pathname]
+    :param history: number of previous versions to keep of updated files,
+        files that already have versions keep as many as they have,
+        defaults to 0
+    :type history: int
     """
 
+    # pylint: disable=too-many-arguments
     def __init__(
         self,
         filename: Pathname,
         passfile: Optional[Pathname] = None,
         autocreate: bool = False,
+        workers: int = INGEST_WORKERS,
+        maxbuffer: int = INGEST_BUFFER,
+        cache: bool = False,
+        cachedir: Optional[Pathname] = None,
+        history: int = 0,
     ):
         self.gpg = GPG()
+        self.workers = workers
+        self.maxbuffer = maxbuffer
+        self.history = history
         self.filename = Path(filename)
         self.exists = self.filename.is_file()
         if not self.exists and not autocreate:
@@ -53,19 +109,74 @@ class Targpg:
             if not create.startswith("y"):
                 raise FileNotFoundError("No secure file to load")
         self.password = self._load_pass(passfile)
+        self.cache = None
+        if cache:
+            self.cache = MetaCache(self.filename, cachedir or _cachedir(), self.gpg)
+        self.cached = None
+        self.fingerprint = None
+        self.base = None if self.exists else {}
+        self.basepass = self.password
         self.raw = BytesIO()
-        # pylint: disable=consider-using-with
-        self.tar = tarfile.TarFile(fileobj=self.raw, mode="w")
+        self.members = MemberTable()
         if self.exists:
+            data = self.filename.read_bytes()
+            if self.cache:
+                self.fingerprint = MetaCache.fingerprint(self.filename, data)
+                cached = self.cache.load(self.fingerprint, self.password)
+                if cached is not None:
+                    self.members, self.cached = cached
+            if self.cached is None:
+                self._load_tar(data)
+                if self.cache:
+                    self.cache.store(
+                        self.fingerprint,
+                        self.members,
+                        self._index(),
+                        self.password,
+                    )
+
+    @property
+    def tar(self) -> tarfile.TarFile:
+        """Tar in read mode over the current contents of the archive
+
+        Kept for compatibility, `members` lists the archive without parsing
+        a `TarInfo` for every member. Stored versions of updated files show
+        up as members under `.targpg-history`.
+        """
+        self._require_tar()
+        return self._reader()
+
+    def _require_tar(self):
+        """Decrypt the archive if members have only been read from the cache"""
+        if self.cached is not None:
+            fingerprint = self.fingerprint
+            names = self.members.names
             self._load_tar()
+            if self.fingerprint == fingerprint:
+                self.base = dict(zip(names, self.cached))
+            self.cached = None
+
+    def _snapshot(self):
+        """Remember member digests before the first change so edits made by
+        other writers in the meantime can be merged on save"""
+        if self.base is None:
+            self.base = dict(zip(self.members.names, self._index()))
+
+    def _load_tar(self, data: Optional[bytes] = None):
+        if data is None:
+            data = self.filename.read_bytes()
+        self.fingerprint = MetaCache.fingerprint(self.filename, data)
+        self.raw, self.members = self._unpack(self._decrypt(data))
 
-    def _load_tar(self):
-        try:
-            with tarfile.open(fileobj=self._decrypt(), mode="r:gz") as fp:
-                for member in fp.getmembers():
-                    self.tar.addfile(member, fp.extractfile(member))
-        except tarfile.ReadError:
-            pass
+    @staticmethod
+    def _unpack(data: BytesIO) -> Tuple[BytesIO, MemberTable]:
+        """Decompress a tar and read its members, dropping anything after
+        the last one so new members can be appended"""
+        raw = BytesIO(gzip.decompress(data.getvalue()))
+        members = MemberTable.scan(raw)
+        raw.seek(members.end)
+        raw.truncate()
+        return raw, members
 
     def _manual_pass(self):
         newpass = getpass("New Password: ")
@@ -82,23 +193,25 @@ class Targpg:
             return self._manual_pass()
         return getpass()
 
-    def _readmode(self):
-        if not self.tar.mode.startswith("r"):
-            self.tar.close()
-            self.raw.seek(0)
-            # pylint: disable=consider-using-with
-            self.tar = tarfile.TarFile(fileobj=self.raw, mode="r")
+    def _reader(self) -> tarfile.TarFile:
+        self.raw.seek(0)
+        # pylint: disable=consider-using-with
+        return tarfile.TarFile(fileobj=self.raw, mode="r")
+
+    @staticmethod
+    def _writer(raw: BytesIO, members: MemberTable) -> tarfile.TarFile:
+        """Open a tar for writing that appends after existing members"""
+        raw.seek(members.end)
+        # pylint: disable=consider-using-with
+        return tarfile.TarFile(fileobj=raw, mode="w")
 
-    def _writemode(self):
-        if not self.tar.mode.startswith("w"):
-            self.tar.close()
-            self.raw.seek(0)
-            # pylint: disable=consider-using-with
-            self.tar = tarfile.TarFile(fileobj=self.raw, mode="w")
+    def _payload(self, row: int) -> bytes:
+        start = self.members.datas[row]
+        with self.raw.getbuffer() as view:
+            return bytes(view[start : start + self.members.sizes[row]])
 
-    def _decrypt(self) -> BytesIO:
-        with open(self.filename, "rb") as fp:
-            data = self.gpg.decrypt_file(fp, passphrase=self.password)
+    def _decrypt(self, data: bytes, password: Optional[str] = None) -> BytesIO:
+        data = self.gpg.decrypt(data, passphrase=password or self.password)
 
         if not data.ok:
             raise PermissionError(f"Unable to decrypt {self.filename}; {data.status}")
@@ -152,24 +265,359 @@ class Targpg:
         f = str(filepath)
         return f if f[-1] != "/" else f[:-1]
 
+    @staticmethod
+    def _excluded(arcname: str, exclude: Optional[List[str]]) -> bool:
+        if not exclude:
+            return False
+        basename = arcname.rsplit("/", 1)[-1]
+        return any(fnmatch(arcname, p) or fnmatch(basename, p) for p in exclude)
+
+    def _replaced(
+        self,
+        name: str,
+        names: Set[str],
+        exclude: Optional[List[str]] = None,
+    ) -> bool:
+        """If updating `names` replaces an archived member, it's one of them
+        or under one and none of the paths walked to reach it are excluded"""
+        parts = name.split("/")
+        for idx in range(1, len(parts) + 1):
+            if "/".join(parts[:idx]) in names:
+                return not any(
+                    self._excluded("/".join(parts[:end]), exclude)
+                    for end in range(idx, len(parts) + 1)
+                )
+        return False
+
+    def _walk(
+        self,
+        tar: tarfile.TarFile,
+        filepath: str,
+        arcname: str,
+        exclude: Optional[List[str]],
+    ) -> Iterator[Tuple[tarfile.TarInfo, str]]:
+        """Yield the tarinfo of a path and everything under it in the same
+        order `TarFile.add` would, skipping excluded subtrees entirely"""
+        if self._excluded(arcname, exclude):
+            tglog.debug("excluding; %s", arcname)
+            return
+        tarinfo = tar.gettarinfo(filepath, arcname)
+        if tarinfo is None:
+            tglog.debug("unsupported file type; %s", filepath)
+            return
+        yield tarinfo, filepath
+        if tarinfo.isdir():
+            with os.scandir(filepath) as entries:
+                names = sorted(entry.name for entry in entries)
+            for name in names:
+                yield from self._walk(
+                    tar,
+                    os.path.join(filepath, name),
+                    f"{arcname}/{name}",
+                    exclude,
+                )
+
+    @staticmethod
+    def _read(filepath: str, size: int) -> bytes:
+        with open(filepath, "rb") as fp:
+            return fp.read(size)
+
+    @staticmethod
+    def _flush(
+        tar: tarfile.TarFile,
+        members: MemberTable,
+        tarinfo: tarfile.TarInfo,
+        filepath: str,
+        future: Optional[Future],
+    ) -> int:
+        if future is not None:
+            members.addfile(tar, tarinfo, BytesIO(future.result()))
+            return tarinfo.size
+        if tarinfo.isreg():
+            with open(filepath, "rb") as fp:
+                members.addfile(tar, tarinfo, fp)
+        else:
+            members.addfile(tar, tarinfo)
+        return 0
+
+    def _ingest(
+        self,
+        raw: BytesIO,
+        members: MemberTable,
+        sources: Iterable[Tuple[str, str]],
+        exclude: Optional[List[str]] = None,
+    ) -> MemberTable:
+        """Add paths to the tar, reading file contents ahead on a thread pool
+
+        Members are written in the order they are walked. Reads are only
+        scheduled while the data waiting to be written stays under
+        `maxbuffer`, files bigger than that are streamed straight from disk.
+        """
+        tar = self._writer(raw, members)
+        pending = deque()
+        depth = self.workers * 16
+        inflight = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for filepath, arcname in sources:
+                tglog.debug("adding; %s", arcname)
+                for tarinfo, path in self._walk(tar, filepath, arcname, exclude):
+                    size = tarinfo.size if tarinfo.isreg() else 0
+                    while pending and (
+                        inflight + size > self.maxbuffer or len(pending) >= depth
+                    ):
+                        inflight -= self._flush(tar, members, *pending.popleft())
+                    future = None
+                    if tarinfo.isreg() and size <= self.maxbuffer:
+                        future = pool.submit(self._read, path, size)
+                        inflight += size
+                    pending.append((tarinfo, path, future))
+            while pending:
+                self._flush(tar, members, *pending.popleft())
+        return members
+
+    @staticmethod
+    def _copy(
+        raw: BytesIO,
+        members: MemberTable,
+        view: memoryview,
+        source: MemberTable,
+        rows: Iterable[int],
+    ) -> MemberTable:
+        """Append members of another tar as raw header and data blocks
+
+        Headers are not parsed or rebuilt, members next to each other in
+        the source are written with a single slice of `view`.
+        """
+        runs = []
+        pos = members.end
+        for row in rows:
+            start, end = source.offsets[row], source.ends[row]
+            members.copyrow(source, row, pos)
+            pos += end - start
+            if runs and runs[-1][1] == start:
+                runs[-1][1] = end
+            else:
+                runs.append([start, end])
+        raw.seek(members.end)
+        for start, end in runs:
+            raw.write(view[start:end])
+        members.end = pos
+        return members
+
+    @staticmethod
+    def _digests(view: memoryview, members: MemberTable) -> List[str]:
+        digests = []
+        for start, size, end in zip(members.datas, members.sizes, members.ends):
+            digests.append(sha256(view[start : min(start + size, end)]).hexdigest())
+        return digests
+
+    def _index(self) -> List[str]:
+        """The sha256 of the contents of every member"""
+        with self.raw.getbuffer() as view:
+            return self._digests(view, self.members)
+
+    @contextmanager
+    def _lock(self, filename: Path):
+        """Hold an advisory lock on the archive while it's being replaced"""
+        if fcntl is None:
+            tglog.debug("file locking not supported; %s", filename)
+            yield
+            return
+        lockfile = filename.with_name(filename.name + ".lock")
+        with open(lockfile, "a", encoding="utf-8") as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    # pylint: disable=too-many-locals
+    def _rebase(self, data: bytes):
+        """Merge the changes made since loading onto a newer archive version
+
+        Every member is compared between the version originally loaded, the
+        one in memory and the one on disk. Whichever side changed it wins, if
+        both changed it differently the merge fails.
+
+        :raises RuntimeError: the same member was changed by both sides
+        """
+        tglog.debug("archive changed since it was loaded; %s", self.filename)
+        theirs, their_members = self._unpack(self._decrypt(data, self.basepass))
+
+        with self.raw.getbuffer() as ours, theirs.getbuffer() as their_view:
+            sides = {
+                "theirs": (their_view, their_members),
+                "ours": (ours, self.members),
+            }
+            found = {}
+            for side, (view, members) in sides.items():
+                digests = self._digests(view, members)
+                for row, (name, digest) in enumerate(zip(members.names, digests)):
+                    found.setdefault(name, {})[side] = (row, digest)
+            base = self.base
+            if base is None:
+                base = {n: f["ours"][1] for n, f in found.items() if "ours" in f}
+
+            picked = []
+            conflicts = []
+            for name, rows in found.items():
+                ourdigest = rows["ours"][1] if "ours" in rows else None
+                theirdigest = rows["theirs"][1] if "theirs" in rows else None
+                if ourdigest == base.get(name):
+                    side = "theirs"
+                elif theirdigest in (base.get(name), ourdigest):
+                    side = "ours"
+                else:
+                    conflicts.append(name)
+                    continue
+                if side in rows:
+                    picked.append((side, rows[side][0]))
+            if conflicts:
+                raise RuntimeError(
+                    f"File(s) changed in archive since it was loaded; {conflicts}"
+                )
+
+            temp = BytesIO()
+            members = MemberTable()
+            start = 0
+            for idx in range(1, len(picked) + 1):
+                if idx == len(picked) or picked[idx][0] != picked[start][0]:
+                    view, source = sides[picked[start][0]]
+                    rows = [row for _, row in picked[start:idx]]
+                    self._copy(temp, members, view, source, rows)
+                    start = idx
+
+        self.raw.close()
+        self.raw = temp
+        self.members = members
+
+    @staticmethod
+    def _hidden(name: str) -> bool:
+        """If a member is a stored version rather than a file"""
+        return VERSIONED.fullmatch(name) is not None
+
+    @staticmethod
+    def _historyname(name: str, version: int) -> str:
+        return f"{HISTORY_DIR}/{name};{version}"
+
+    @staticmethod
+    def _versioned(name: str) -> Tuple[str, int]:
+        """File a stored version belongs to and how many updates ago it is"""
+        name, version = VERSIONED.fullmatch(name).groups()
+        return name, int(version)
+
+    def _sources(
+        self,
+        filenames: Iterable[Pathname],
+        directory: Optional[Pathname],
+    ) -> List[Tuple[str, str]]:
+        sources = [self._path(filename, directory) for filename in filenames]
+        reserved = [
+            arcname
+            for _, arcname in sources
+            if f"{arcname.lstrip('/')}/".startswith(HISTORY_DIR + "/")
+        ]
+        if reserved:
+            raise ValueError(f"File(s) are in the reserved {HISTORY_DIR}; {reserved}")
+        return sources
+
+    def _names(self, version: int = 0) -> List[str]:
+        """Names of the files in the archive, or of the files that have
+        `version` previous versions stored when it isn't 0"""
+        if not version:
+            return [name for name in self.members.names if not self._hidden(name)]
+        suffix = f";{version}"
+        return [
+            name[len(HISTORY_DIR) + 1 : -len(suffix)]
+            for name in self.members.names
+            if self._hidden(name) and name.endswith(suffix)
+        ]
+
     def _unchanged(
         self,
-        newtar: tarfile.TarFile,
+        raw: BytesIO,
+        members: MemberTable,
+        filenames: Pathname,
+        exclude: Optional[List[str]] = None,
+    ) -> MemberTable:
+        names = {self._clean_name(f) for f in filenames}
+        kept = []
+        for row, name in enumerate(self.members.names):
+            if self._hidden(name):
+                name, _ = self._versioned(name)
+            if not self._replaced(name, names, exclude):
+                kept.append(row)
+        with self.raw.getbuffer() as view:
+            return self._copy(raw, members, view, self.members, kept)
+
+    def _versions(
+        self,
         filenames: Pathname,
-    ) -> tarfile.TarFile:
-        for member in self.tar.getmembers():
-            for filename in [str(f) for f in filenames]:
-                if filename[-1] == "/":
-                    filename = filename[:-1]
-                fnasdir = filename + "/"
-                if member.name != filename and not member.name.startswith(fnasdir):
-                    newtar.addfile(member, self.tar.extractfile(member))
-        return newtar
+        exclude: Optional[List[str]] = None,
+    ) -> Dict[str, Tuple[int, List[Tuple[tarfile.TarInfo, bytes]]]]:
+        """Collect the current and stored versions of files about to be
+        updated, newest first, along with how many versions to keep"""
+        names = {self._clean_name(f) for f in filenames}
+        members = self.members
+        current = {}
+        stored = {}
+        for row, name in enumerate(members.names):
+            if self._hidden(name):
+                name, version = self._versioned(name)
+                stored.setdefault(name, {})[version] = row
+            elif members.isreg(row) and self._replaced(name, names, exclude):
+                current[name] = row
+
+        versions = {}
+        reader = None
+        for name, row in current.items():
+            older = stored.get(name, {})
+            keep = self.history or len(older)
+            if not keep:
+                continue
+            reader = reader or self._reader()
+            data = self._payload(row)
+            found = [(members.tarinfo(reader, row), data)]
+            for version in sorted(older)[:keep]:
+                delta = self._payload(older[version])
+                tarinfo = members.tarinfo(reader, older[version])
+                found.append((tarinfo, apply_delta(data, delta)))
+            versions[name] = (keep, found)
+        return versions
+
+    def _record(
+        self,
+        versions: Dict[str, Tuple[int, List[Tuple[tarfile.TarInfo, bytes]]]],
+    ):
+        """Store previous versions of updated files as deltas against their
+        new contents, files whose contents didn't change keep the versions
+        they had"""
+        contents = {
+            name: self._payload(row)
+            for row, name in enumerate(self.members.names)
+            if name in versions and self.members.isreg(row)
+        }
+        tar = self._writer(self.raw, self.members)
+        for name, data in contents.items():
+            keep, found = versions[name]
+            if found[0][1] == data:
+                found = found[1:]
+            for version, (member, older) in enumerate(found[:keep], 1):
+                tglog.debug("storing version %s; %s", version, name)
+                delta = make_delta(data, older)
+                tarinfo = tarfile.TarInfo(self._historyname(name, version))
+                tarinfo.size = len(delta)
+                tarinfo.mtime = member.mtime
+                tarinfo.mode = member.mode
+                tarinfo.uid, tarinfo.gid = member.uid, member.gid
+                tarinfo.uname, tarinfo.gname = member.uname, member.gname
+                self.members.addfile(tar, tarinfo, BytesIO(delta))
 
     def add(
         self,
         *filenames: Pathname,
         directory: Optional[Pathname] = None,
+        exclude: Optional[List[str]] = None,
     ) -> "Targpg":
         """Add new files to the archive
 
@@ -178,24 +626,26 @@ class Targpg:
         :param directory: archive filepath is relative to this directory,
             defaults to None
         :type directory: Optional[Pathname], optional
-        :raises ValueError: a duplicate file is being added
+        :param exclude: glob patterns of archive paths or basenames to skip,
+            defaults to None
+        :type exclude: Optional[List[str]], optional
+        :raises ValueError: a duplicate file is being added, or one in the
+            directory stored versions are kept in
         :return: self to allow chaining
         :rtype: Targpg
         """
         if not filenames:
             return self
 
-        self._writemode()
+        sources = self._sources(filenames, directory)
+        self._require_tar()
+        self._snapshot()
 
-        tarfiles = self.tar.getnames()
-        dupes = [f for f in filenames if self._clean_name(f) in tarfiles]
+        dupes = [f for f in filenames if self._clean_name(f) in self.members]
         if dupes:
             raise ValueError(f"File(s) already exists in archive; {dupes}")
 
-        for filename in filenames:
-            fullfile, addfile = self._path(filename, directory)
-            tglog.debug("adding; %s", addfile)
-            self.tar.add(fullfile, arcname=addfile)
+        self._ingest(self.raw, self.members, sources, exclude)
 
         return self
 
@@ -203,6 +653,7 @@ class Targpg:
         self,
         *filenames: Pathname,
         directory: Optional[Pathname] = None,
+        exclude: Optional[List[str]] = None,
     ) -> "Targpg":
         """Update an existing file in the archvie
 
@@ -211,30 +662,32 @@ class Targpg:
         :param directory: archive filepath is relative to this directory,
             defaults to None
         :type directory: Optional[Pathname], optional
-        :raises ValueError: a nonexistant file is being updated
+        :param exclude: glob patterns of archive paths or basenames to skip,
+            members matching them are kept as they are, defaults to None
+        :type exclude: Optional[List[str]], optional
+        :raises ValueError: a nonexistant file is being updated, or one in
+            the directory stored versions are kept in
         :return: self to allow chaining
         :rtype: Targpg
         """
+        sources = self._sources(filenames, directory)
+        self._require_tar()
+        self._snapshot()
 
-        tarfiles = self.tar.getnames()
-        unique = [f for f in filenames if self._clean_name(f) not in tarfiles]
+        unique = [f for f in filenames if self._clean_name(f) not in self.members]
         if unique:
             raise ValueError(f"File(s) do not exists in archive; {unique}")
 
+        versions = self._versions(filenames, exclude)
         temp = BytesIO()
-        # pylint: disable=consider-using-with
-        newtar = tarfile.TarFile(fileobj=temp, mode="w")
-        self._readmode()
-        newtar = self._unchanged(newtar, filenames)
-
-        filenames = [self._path(filename, directory) for filename in filenames]
-        for filepath, arcname in filenames:
-            tglog.debug("adding; %s", arcname)
-            newtar.add(filepath, arcname=arcname)
+        members = self._unchanged(temp, MemberTable(), filenames, exclude)
+        members = self._ingest(temp, members, sources, exclude)
 
         self.raw.close()
         self.raw = temp
-        self.tar = newtar
+        self.members = members
+        if versions:
+            self._record(versions)
 
         return self
 
@@ -253,25 +706,28 @@ class Targpg:
         :return: self to allow chaining
         :rtype: Targpg
         """
+        self._require_tar()
+        self._snapshot()
 
-        tarfiles = self.tar.getnames()
-        notin = [f for f in filenames if self._clean_name(f) not in tarfiles]
+        notin = [f for f in filenames if self._clean_name(f) not in self.members]
         if notin:
             raise ValueError(f"File(s) do not exists in archive; {notin}")
 
         temp = BytesIO()
-        # pylint: disable=consider-using-with
-        newtar = tarfile.TarFile(fileobj=temp, mode="w")
-        self._readmode()
-        newtar = self._unchanged(newtar, filenames)
+        members = self._unchanged(temp, MemberTable(), filenames)
 
         self.raw.close()
         self.raw = temp
-        self.tar = newtar
+        self.members = members
 
         return self
 
-    def extract(self, *filenames: Pathname, outdir: Pathname = ".") -> "Targpg":
+    def extract(
+        self,
+        *filenames: Pathname,
+        outdir: Pathname = ".",
+        version: int = 0,
+    ) -> "Targpg":
         """Extract a file from the archive.
 
             If no filenames are given, a list will be displayed  and input will
@@ -281,12 +737,15 @@ class Targpg:
         :type *filenames: Pathname
         :param outdir: directory to export files into, defaults to "."
         :type outdir: Pathname, optional
+        :param version: extract the file as it was this many updates ago,
+            defaults to 0
+        :type version: int, optional
         :return: self to allow chaining
         :rtype: Targpg
         """
-        names = self.tar.getnames()
         filenames = [str(f) for f in filenames]
         if not filenames:
+            names = self._names(version)
             pad = len(str(len(names)))
             for idx, name in enumerate(names):
                 tglog.info("%s %s", str(idx).rjust(pad), name)
@@ -296,32 +755,146 @@ class Targpg:
         else:
             oknames = []
             for filename in filenames:
-                if filename not in names:
+                if version:
+                    found = self._historyname(filename, version) in self.members
+                else:
+                    found = filename in self.members and not self._hidden(filename)
+                if not found:
                     tglog.debug("name not in opts; %s", filename)
                 else:
                     oknames.append(filename)
             filenames = oknames
-        self._readmode()
-        for filename in filenames:
-            tglog.debug("extracting; %s", filename)
-            self.tar.extract(filename, path=outdir)
+        if not filenames:
+            return self
+        self._require_tar()
+        with self._reader() as reader:
+            for filename in filenames:
+                tglog.debug("extracting; %s", filename)
+                row = self.members.get(filename)
+                if not version:
+                    tarinfo = self.members.tarinfo(reader, row)
+                    reader.extract(tarinfo, path=outdir)
+                    continue
+                older = self.members.get(self._historyname(filename, version))
+                tarinfo = self.members.tarinfo(reader, older)
+                data = apply_delta(self._payload(row), self._payload(older))
+                outfile = Path(outdir, filename)
+                outfile.parent.mkdir(parents=True, exist_ok=True)
+                outfile.write_bytes(data)
+                os.chmod(outfile, tarinfo.mode)
+                os.utime(outfile, (tarinfo.mtime, tarinfo.mtime))
 
         return self
 
-    def list(self):
-        """List contents of the archvie to stdout"""
-        self.tar.list()
+    def list(self, version: int = 0):
+        """List contents of the archvie to stdout
+
+        :param version: list the files that have a version stored from this
+            many updates ago, as they were then, defaults to 0
+        :type version: int, optional
+        """
+        members = self.members
+        if not version:
+            rows = [
+                (row, name, members.sizes[row])
+                for row, name in enumerate(members.names)
+                if not self._hidden(name)
+            ]
+        else:
+            self._require_tar()
+            members = self.members
+            rows = []
+            for name in self._names(version):
+                row = members.get(self._historyname(name, version))
+                rows.append((row, name, delta_size(self._payload(row))))
+        for row, name, size in rows:
+            uid = members.unames[row] or members.uids[row]
+            gid = members.gnames[row] or members.gids[row]
+            if members.isdev(row):
+                size = f"{members.devmajors[row]},{members.devminors[row]}"
+            line = [
+                filemode(members.modes[row]),
+                f"{uid}/{gid}",
+                f"{size:>10}",
+                strftime("%Y-%m-%d %H:%M:%S", localtime(members.mtimes[row])),
+                name + ("/" if members.isdir(row) else ""),
+            ]
+            if members.types[row] == tarfile.SYMTYPE[0]:
+                line.append("-> " + members.linknames[row])
+            if members.types[row] == tarfile.LNKTYPE[0]:
+                line.append("link to " + members.linknames[row])
+            print(" ".join(line))
+
+    @staticmethod
+    def _grep(regex: "re.Pattern", data: memoryview) -> List[int]:
+        if b"\0" in bytes(data[:BINARY_SNIFF]):
+            return []
+        return [match.start() for match in regex.finditer(data)]
+
+    def search(
+        self,
+        pattern: Union[str, bytes],
+        names: Optional[Iterable[Pathname]] = None,
+    ) -> Iterator[Tuple[str, int]]:
+        """Find files in the archive with contents matching a pattern
+
+        Files are scanned in memory straight out of the tar buffer, without
+        being extracted or copied. Files that look binary, with a NUL byte
+        near the start, are skipped. Files are scanned one after another,
+        `re` holds the GIL while matching so threads wouldn't scan them any
+        faster. The tar buffer is only held while a file is being scanned, so
+        files can be added to the archive while a search is paused.
+
+        :param pattern: regular expression, str patterns are utf-8 encoded
+        :type pattern: Union[str, bytes]
+        :param names: only search these files and directories,
+            defaults to every file
+        :type names: Optional[Iterable[Pathname]], optional
+        :raises ValueError: a nonexistant file is being searched
+        :yield: name of a matching file and the offset of the match,
+            in the order the files are in the archive
+        :rtype: Iterator[Tuple[str, int]]
+        """
+        if isinstance(pattern, str):
+            pattern = pattern.encode("utf-8")
+        regex = re.compile(pattern)
+
+        self._require_tar()
+        raw, members = self.raw, self.members
+        if names is not None:
+            names = {self._clean_name(name) for name in names}
+            notin = [name for name in names if name not in members]
+            if notin:
+                raise ValueError(f"File(s) do not exists in archive; {notin}")
+        prefixes = tuple(name + "/" for name in names or ())
+        rows = [
+            row
+            for row, name in enumerate(members.names)
+            if members.isreg(row)
+            and not self._hidden(name)
+            and (names is None or name in names or name.startswith(prefixes))
+        ]
+
+        for row in rows:
+            start = members.datas[row]
+            with raw.getbuffer() as view:
+                with view[start : start + members.sizes[row]] as data:
+                    offsets = self._grep(regex, data)
+            for offset in offsets:
+                yield members.names[row], offset
 
     def newpass(self, loadfile: Pathname = None) -> "Targpg":
         if loadfile is not None:
             self.password = self._load_pass(loadfile)
-            return self
-        fromfile = input("Load from file? ").lower()
-        if len(fromfile) and fromfile[0] == "y":
-            filename = input("Filename: ")
-            self.password = self._load_pass(filename)
         else:
-            self.password = self._manual_pass()
+            fromfile = input("Load from file? ").lower()
+            if len(fromfile) and fromfile[0] == "y":
+                filename = input("Filename: ")
+                self.password = self._load_pass(filename)
+            else:
+                self.password = self._manual_pass()
+        if self.cache:
+            self.cache.clear()
         return self
 
     def save(self, filename: Pathname = None) -> "Targpg":
@@ -330,20 +903,59 @@ class Targpg:
         If no filename is given, original filename is used.
         No data is written to disk until this method is called.
 
+        When saving over the loaded archive it is locked while being written
+        and replaced in one step, keeping its permissions and writing through
+        symlinks. If another process saved it since it was loaded, those
+        changes are merged with the ones made here first.
+
         :param filename: Pathname to save archive to,
             defaults to loaded archive name
         :type filename: Pathname
+        :raises RuntimeError: a file was changed here and in the newer archive
         :return: self to allow chaining
         :rtype: Targpg
         """
-        tocrypt = self._compress(self.raw)
-        data = self._encrypt(tocrypt)
-        with open(filename or self.filename, "wb") as fp:
-            fp.write(data)
+        self._require_tar()
+        filename = Path(filename or self.filename)
+        if filename.resolve() != self.filename.resolve():
+            data = self._encrypt(self._compress(self.raw))
+            with open(filename, "wb") as fp:
+                fp.write(data)
+            return self
+
+        target = filename.resolve()
+        try:
+            with self._lock(target):
+                if target.is_file():
+                    current = target.read_bytes()
+                    if MetaCache.fingerprint(target, current) != self.fingerprint:
+                        self._rebase(current)
+
+                data = self._encrypt(self._compress(self.raw))
+                temp = target.with_name(f".{target.name}.tmp")
+                with open(temp, "wb") as fp:
+                    fp.write(data)
+                if target.is_file():
+                    shutil.copymode(target, temp)
+                os.replace(temp, target)
+                self.fingerprint = MetaCache.fingerprint(filename, data)
+        except Exception:
+            if self.cache:
+                self.cache.clear()
+            raise
+
+        self.base = None
+        self.basepass = self.password
+        if self.cache:
+            self.cache.store(
+                self.fingerprint,
+                self.members,
+                self._index(),
+                self.password,
+            )
 
         return self
 
     def exit(self):
-        """Close the tar and byte streams in memory for cleanup"""
-        self.tar.close()
+        """Close the byte stream in memory for cleanup"""
         self.raw.close()
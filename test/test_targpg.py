@@ -1,12 +1,18 @@
 """Testing targpg"""
-from io import StringIO
-from os import makedirs
+import tarfile
+from io import BytesIO, StringIO
+from os import makedirs, urandom
 from pathlib import Path
 from shutil import rmtree
-from unittest import TestCase
+from unittest import TestCase, skipUnless
 from unittest.mock import Mock, patch
 
-from targpg import Targpg, tglog
+from targpg import MemberTable, Targpg, apply_delta, make_delta, tglog
+
+try:
+    from targpg.fs import TargpgFileSystem
+except ImportError:
+    TargpgFileSystem = None
 
 tglog.setLevel("CRITICAL")
 
@@ -171,7 +177,8 @@ class TargpgTests(TestCase):
         """Extract files from the archive"""
         gt = Targpg(self.archive, passfile=self.passfile, autocreate=True)
         gt.add(self.file1, self.file2)
-        gt.extract(self.file1, outdir=self.extr)
+        with patch.object(Targpg, "_names", side_effect=AssertionError):
+            gt.extract(self.file1, outdir=self.extr)
         self.assertFileExists(
             Path(self.extr, self.file1),
             "File should be extracted when passed as an argument",
@@ -211,3 +218,404 @@ class TargpgTests(TestCase):
             msg="Should not open file with old password",
         ):
             Targpg(self.archive, passfile=self.passfile)
+
+    def test_09_add_directory_exclude(self):
+        """Add a directory while skipping excluded paths"""
+        tree = Path(self.work, "tree")
+        self._make_clean(Path(tree, "keep"))
+        self._make_clean(Path(tree, "skip"))
+        Path(tree, "keep", "a.txt").write_text("a", encoding="utf-8")
+        Path(tree, "keep", "b.log").write_text("b", encoding="utf-8")
+        Path(tree, "skip", "c.txt").write_text("c", encoding="utf-8")
+
+        gt = Targpg(
+            self.archive,
+            passfile=self.passfile,
+            autocreate=True,
+            maxbuffer=1,
+        )
+        gt.add(tree, exclude=["skip", "*.log"])
+        self.assertEqual(
+            gt.members.names,
+            [str(tree), f"{tree}/keep", f"{tree}/keep/a.txt"],
+            "Walked paths should be added in order without excluded paths",
+        )
+        gt.extract(f"{tree}/keep/a.txt", outdir=self.extr)
+        self.assertEqual(
+            Path(self.extr, tree, "keep", "a.txt").read_text(encoding="utf-8"),
+            "a",
+            "File contents should be read into the archive",
+        )
+
+        gt.remove(tree).add(tree)
+        gt.update(tree, exclude=["skip"])
+        self.assertEqual(
+            sorted(gt.members.names),
+            sorted(
+                [
+                    str(tree),
+                    f"{tree}/keep",
+                    f"{tree}/keep/a.txt",
+                    f"{tree}/keep/b.log",
+                    f"{tree}/skip",
+                    f"{tree}/skip/c.txt",
+                ]
+            ),
+            "Excluded paths should be kept as they are when updating",
+        )
+
+    def test_10_rebuild_keeps_members(self):
+        """Removing and updating keeps the other members intact"""
+        self._create().exit()
+        gt = Targpg(self.archive, passfile=self.passfile)
+        gt.extract(self.file1, outdir=self.extr)
+        gt.add(self.passfile)
+        gt.remove(self.file1, self.passfile)
+        self.assertEqual(
+            gt.members.names,
+            [str(self.file2)],
+            "Only the removed members should be dropped",
+        )
+
+        gt.update(self.file2)
+        gt.extract(self.file2, outdir=self.extr)
+        self.assertEqual(
+            Path(self.extr, self.file2).read_text(encoding="utf-8"),
+            self.file2_data,
+            "Kept members should be copied with their contents",
+        )
+
+    def test_11_cache(self):
+        """List from the encrypted member cache without decrypting"""
+        cachedir = Path(self.work, "cache")
+        gt = Targpg(
+            self.archive,
+            passfile=self.passfile,
+            autocreate=True,
+            cache=True,
+            cachedir=cachedir,
+        )
+        gt.add(self.file1, self.file2)
+        gt.save().exit()
+
+        with patch.object(Targpg, "_decrypt", side_effect=AssertionError):
+            gt = Targpg(
+                self.archive,
+                passfile=self.passfile,
+                cache=True,
+                cachedir=cachedir,
+            )
+            with patch("sys.stdout", new_callable=StringIO) as mock_stdout:
+                gt.list()
+            gt.extract("missing", outdir=self.extr)
+        self.assertEqual(
+            len(mock_stdout.getvalue().splitlines()),
+            2,
+            "Members should be listed from the cache",
+        )
+
+        gt.remove(self.file1).save().exit()
+        gt = Targpg(self.archive, passfile=self.passfile)
+        gt.add(self.file1).save().exit()
+        gt = Targpg(
+            self.archive,
+            passfile=self.passfile,
+            cache=True,
+            cachedir=cachedir,
+        )
+        self.assertIsNone(
+            gt.cached,
+            "Cache should not be used once the archive changes",
+        )
+
+        with self.assertRaises(
+            PermissionError,
+            msg="Cache should not open with the wrong password",
+        ):
+            Targpg(
+                self.archive,
+                passfile=self.wrongpass,
+                cache=True,
+                cachedir=cachedir,
+            )
+
+        gt.newpass(self.newpass)
+        self.assertFileNotExists(
+            gt.cache.filename,
+            "Cache should be dropped when the password changes",
+        )
+        with patch.object(Path, "home", side_effect=RuntimeError):
+            Targpg(self.archive, passfile=self.passfile).exit()
+
+    def test_12_concurrent_save(self):
+        """Saves from writers that loaded the same version are merged"""
+        self._create().exit()
+        first = Targpg(self.archive, passfile=self.passfile)
+        second = Targpg(self.archive, passfile=self.passfile)
+        first.add(self.passfile).save().exit()
+        second.remove(self.file1).save().exit()
+
+        gt = Targpg(self.archive, passfile=self.passfile)
+        self.assertEqual(
+            sorted(gt.members.names),
+            sorted([str(self.file2), str(self.passfile)]),
+            "Changes to different files should both be kept",
+        )
+
+        changed = Path(self.work, "changed.txt")
+        changed.write_text("before", encoding="utf-8")
+        gt.add(changed).save().exit()
+        first = Targpg(self.archive, passfile=self.passfile)
+        second = Targpg(self.archive, passfile=self.passfile)
+        first.remove(changed).save().exit()
+        changed.write_text("after", encoding="utf-8")
+        second.update(changed)
+        with self.assertRaises(
+            RuntimeError,
+            msg="Changes to the same file should not be merged",
+        ):
+            second.save()
+
+    def test_13_history(self):
+        """Previous versions are kept and can be extracted"""
+        versioned = Path(self.work, "versioned.txt")
+        versioned.write_text("first version", encoding="utf-8")
+        gt = Targpg(
+            self.archive,
+            passfile=self.passfile,
+            autocreate=True,
+            history=2,
+        )
+        gt.add(versioned)
+        for text in ("second version", "third version", "fourth version"):
+            versioned.write_text(text, encoding="utf-8")
+            gt.update(versioned)
+        gt.save().exit()
+
+        gt = Targpg(self.archive, passfile=self.passfile)
+        with patch("sys.stdout", new_callable=StringIO) as mock_stdout:
+            gt.list()
+        self.assertEqual(
+            len(mock_stdout.getvalue().splitlines()),
+            1,
+            "Stored versions should not be listed as files",
+        )
+        with patch("sys.stdout", new_callable=StringIO) as mock_stdout:
+            gt.list(version=3)
+        self.assertEqual(
+            mock_stdout.getvalue(),
+            "",
+            "Only the configured number of versions should be kept",
+        )
+
+        gt.extract(versioned, outdir=self.extr, version=2)
+        self.assertEqual(
+            Path(self.extr, versioned).read_text(encoding="utf-8"),
+            "second version",
+            "Extracting at a version should restore its contents",
+        )
+
+        gt.update(versioned)
+        gt.extract(versioned, outdir=self.extr, version=1)
+        self.assertEqual(
+            Path(self.extr, versioned).read_text(encoding="utf-8"),
+            "third version",
+            "Updating without changes should keep the stored versions",
+        )
+
+        gt.remove(versioned)
+        self.assertEqual(gt.members.names, [], "Removing drops stored versions")
+
+    @skipUnless(TargpgFileSystem, "fsspec is not installed")
+    def test_14_filesystem(self):
+        """Read archive contents through fsspec"""
+        gt = self._create()
+        fs = TargpgFileSystem(gt, cachesize=len(self.file1_data))
+        self.assertEqual(
+            fs.ls(str(self.work), detail=False),
+            [str(self.file1), str(self.file2)],
+            "Files should be listed under their directory",
+        )
+        self.assertEqual(fs.info(self.test)["type"], "directory")
+        self.assertEqual(fs.info(str(self.file2))["size"], len(self.file2_data))
+
+        self.assertEqual(fs.cat(str(self.file1)), self.file1_data.encode("utf-8"))
+        with fs.open(str(self.file2), "rb") as fp:
+            self.assertEqual(fp.read(), self.file2_data.encode("utf-8"))
+        self.assertEqual(
+            list(fs.blocks),
+            [(str(self.file1), 0)],
+            "Only blocks that fit in the cache should be kept",
+        )
+        with self.assertRaises(NotImplementedError):
+            fs.open(str(self.file1), "wb")
+
+        gt.remove(self.file1)
+        self.assertEqual(fs.cat(str(self.file2)), self.file2_data.encode("utf-8"))
+        with self.assertRaises(FileNotFoundError):
+            fs.cat(str(self.file1))
+
+        fs = TargpgFileSystem(gt, blocksize=2)
+        self.assertEqual(fs.cat_file(str(self.file2), 3, -1), b"dby")
+        self.assertEqual(
+            sorted(fs.blocks),
+            [(str(self.file2), 1), (str(self.file2), 2)],
+            "Only the blocks of the requested range should be read",
+        )
+        with fs.open(str(self.file2), "rb") as fp:
+            fp.seek(4)
+            self.assertEqual(fp.read(2), b"by")
+
+    def test_15_search(self):
+        """Search file contents without extracting them"""
+        binary = Path(self.work, "binary.bin")
+        binary.write_bytes(b"\0hello")
+        gt = self._create()
+        gt.add(binary)
+        self.assertEqual(
+            list(gt.search("o")),
+            [(str(self.file1), 4), (str(self.file2), 1), (str(self.file2), 2)],
+            "Every match in text files should be found",
+        )
+        self.assertEqual(
+            list(gt.search(rb"l+", names=[self.file1])),
+            [(str(self.file1), 2)],
+            "Only the named files should be searched",
+        )
+        with self.assertRaises(ValueError):
+            list(gt.search("o", names=["missing"]))
+
+        found = gt.search("o")
+        self.assertEqual(next(found), (str(self.file1), 4))
+        gt.add(self.passfile)
+        self.assertEqual(
+            list(found),
+            [(str(self.file2), 1), (str(self.file2), 2)],
+            "A paused search should not keep the archive from growing",
+        )
+
+    def test_16_save_keeps_link_and_mode(self):
+        """Saving writes through symlinks and keeps the archive permissions"""
+        self._create().exit()
+        self.archive.chmod(0o600)
+        link = Path(self.work, "link.tgz.gpg")
+        link.symlink_to(self.archive.name)
+        try:
+            gt = Targpg(link, passfile=self.passfile)
+            gt.remove(self.file1).save().exit()
+            self.assertTrue(link.is_symlink(), "Symlink should not be replaced")
+            self.assertEqual(self.archive.stat().st_mode & 0o777, 0o600)
+            gt = Targpg(self.archive, passfile=self.passfile)
+            self.assertEqual(
+                gt.members.names,
+                [str(self.file2)],
+                "Changes should be written to the linked archive",
+            )
+        finally:
+            link.unlink()
+
+    def test_17_history_names(self):
+        """Stored versions belong to exactly one file"""
+        plain = Path(self.work, "a")
+        plain.write_text("a", encoding="utf-8")
+        similar = Path(self.work, "a;b")
+        similar.write_text("first", encoding="utf-8")
+        gt = Targpg(
+            self.archive,
+            passfile=self.passfile,
+            autocreate=True,
+            history=1,
+        )
+        gt.add(plain, similar)
+        similar.write_text("second", encoding="utf-8")
+        gt.update(similar)
+        gt.update(plain)
+        gt.remove(plain)
+        self.assertIn(
+            gt._historyname(str(similar), 1),
+            gt.members.names,
+            "Versions of other files should not be dropped",
+        )
+
+        reserved = Path(self.work, ".targpg-history")
+        self._make_clean(reserved)
+        Path(reserved, "note").write_text("note", encoding="utf-8")
+        with self.assertRaises(ValueError):
+            gt.add(Path(reserved.name, "note"), directory=self.work)
+        with self.assertRaises(ValueError):
+            gt.add(reserved.name, directory=self.work)
+
+    def test_18_delta(self):
+        """Deltas rebuild their target and stay small for shifted edits"""
+        base = bytes(range(256)) * 64 + urandom(64 * 1024)
+        target = base[:100] + b"inserted" + base[100:50000] + urandom(99) + base[60000:]
+        delta = make_delta(base, target)
+        self.assertEqual(apply_delta(base, delta), target)
+        self.assertLess(len(delta), 1024, "Shifted content should be copied")
+        unrelated = urandom(4096)
+        self.assertEqual(apply_delta(base, make_delta(base, unrelated)), unrelated)
+
+    def test_19_member_table(self):
+        """Member table positions follow the tar they were read from"""
+        raw = BytesIO()
+        with tarfile.TarFile(fileobj=raw, mode="w") as tar:
+            for name, data in (("one", b"a" * 600), ("two", b""), ("three", b"b")):
+                tarinfo = tarfile.TarInfo(name)
+                tarinfo.size = len(data)
+                tar.addfile(tarinfo, BytesIO(data))
+            device = tarfile.TarInfo("dev")
+            device.type = tarfile.CHRTYPE
+            device.devmajor, device.devminor = 1, 3
+            tar.addfile(device)
+        members = MemberTable.scan(raw)
+        self.assertEqual(members.names, ["one", "two", "three", "dev"])
+        self.assertEqual(list(members.offsets), [0, 1536, 2048, 3072])
+        self.assertEqual(list(members.datas), [512, 2048, 2560, 3584])
+        self.assertEqual(list(members.ends), [1536, 2048, 3072, 3584])
+        self.assertEqual(members.end, 3584, "End should stop before the marker")
+
+        copied = MemberTable()
+        copied.end = 512
+        self.assertEqual(copied.copyrow(members, 2, 512), 0)
+        self.assertEqual(
+            (copied.offsets[0], copied.datas[0], copied.ends[0]),
+            (512, 1024, 1536),
+            "Copied rows should be shifted to their new offset",
+        )
+        self.assertEqual(copied.get("three"), 0)
+
+        rebuilt = MemberTable.fromcolumns(members.columns())
+        self.assertEqual(rebuilt.columns(), members.columns())
+        self.assertEqual(rebuilt.get("dev"), 3)
+        self.assertTrue(rebuilt.isdev(3))
+        self.assertEqual((rebuilt.devmajors[3], rebuilt.devminors[3]), (1, 3))
+
+    def test_20_tar_compat(self):
+        """The tar attribute still reads the archive"""
+        gt = self._create()
+        self.assertEqual(gt.tar.getnames(), [str(self.file1), str(self.file2)])
+        member = gt.tar.getmember(str(self.file1))
+        self.assertEqual(
+            gt.tar.extractfile(member).read(),
+            self.file1_data.encode("utf-8"),
+        )
+
+    def test_21_history_dir_files(self):
+        """Files under the history directory that aren't versions are kept"""
+        raw = BytesIO()
+        with tarfile.TarFile(fileobj=raw, mode="w") as tar:
+            for name in (".targpg-history/notes", "other.txt"):
+                tarinfo = tarfile.TarInfo(name)
+                tarinfo.size = 5
+                tar.addfile(tarinfo, BytesIO(b"notes"))
+        gt = Targpg(self.archive, passfile=self.passfile, autocreate=True)
+        gt.raw, gt.members = gt._unpack(BytesIO(gt._compress(raw)))
+        gt.remove("other.txt")
+        self.assertEqual(gt.members.names, [".targpg-history/notes"])
+        with patch("sys.stdout", new_callable=StringIO) as mock_stdout:
+            gt.list()
+        self.assertIn(
+            ".targpg-history/notes",
+            mock_stdout.getvalue(),
+            "Files that aren't stored versions should be listed",
+        )